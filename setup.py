@@ -28,6 +28,7 @@ def get_long_description():
 # some problems with installation solved this way
 extras = {
     "all": [
+        "aiohttp >= 3.8.0",
         "brotli",
         "cchardet >= 2.1.7; python_version < '3.11'",  # build issue
         "faust-cchardet >= 2.1.18; python_version >= '3.11'",  # fix for build
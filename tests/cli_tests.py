@@ -8,8 +8,11 @@ import os
 import re
 import subprocess
 import sys
+import tempfile
 from contextlib import redirect_stdout
 from datetime import datetime
+from time import sleep, time
+from types import SimpleNamespace
 from unittest.mock import patch
 
 import pytest
@@ -23,6 +26,19 @@ logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 RESOURCES_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'resources')
 
 
+def failing_examine(htmlstring, args, url=None, config=None):
+    "Raise an error in place of extraction, used in worker processes."
+    raise ValueError('extraction failed')
+
+
+def sleeping_examine(htmlstring, args, url=None, config=None):
+    "Hang on a marked document, extract the others, used in worker processes."
+    if b'hanging document' in htmlstring:
+        sleep(60)
+    # not patched in the cli module
+    return cli.examine(htmlstring, args, url, config)
+
+
 def test_parser():
     '''test argument parsing for the command-line interface'''
     testargs = ['', '-fvv', '--xmltei', '--no-tables', '-u', 'https://www.example.org']
@@ -34,7 +50,7 @@ def test_parser():
     assert args.xmltei is True
     assert args.URL == 'https://www.example.org'
     args = cli.map_args(args)
-    assert args.output_format == 'xmltei'
+    assert args.output_format == 'xmltei' and args.output_extension == '.xml'
     testargs = ['', '-out', 'csv', '--no-tables', '-u', 'https://www.example.org']
     with patch.object(sys, 'argv', testargs):
         args = cli.parse_args(testargs)
@@ -55,7 +71,7 @@ def test_parser():
     assert args.output_format == 'csv'
     args.csv, args.json = False, True
     args = cli.map_args(args)
-    assert args.output_format == 'json'
+    assert args.output_format == 'json' and args.output_extension == '.json'
     testargs = ['', '--only-with-metadata']
     with patch.object(sys, 'argv', testargs):
         args = cli.parse_args(testargs)
@@ -144,8 +160,23 @@ def test_input_type():
     with open(testfile, 'r', encoding="utf-8") as f:
         teststring = f.read()
     assert cli.examine(teststring, args) is None
+    # raw bytes on STDIN, the encoding is declared in the document
+    htmlstring = '<html><head><meta charset="iso-8859-1"/></head><body><article>' + \
+                 '<p>Le café de la place est ouvert tous les jours, on y déguste des crêpes à toute heure.</p>' * 5 + \
+                 '</article></body></html>'
+    stdin = SimpleNamespace(buffer=io.BytesIO(htmlstring.encode('iso-8859-1')))
+    f = io.StringIO()
+    with patch.object(sys, 'stdin', stdin), redirect_stdout(f):
+        cli.process_args(args)
+    assert 'Le café de la place' in f.getvalue() and 'crêpes' in f.getvalue()
     # test file list
     assert 10 <= len(list(cli_utils.generate_filelist(RESOURCES_DIR))) <= 20
+    # file size checked before reading
+    testfile = os.path.join(RESOURCES_DIR, 'httpbin_sample.html')
+    config = settings.use_config()
+    assert cli_utils.read_file(testfile, config)[1] is not None
+    config['DEFAULT']['MAX_FILE_SIZE'] = '100'
+    assert cli_utils.read_file(testfile, config) == (testfile, None)
 
 
 def test_sysoutput():
@@ -165,6 +196,9 @@ def test_sysoutput():
     with patch.object(sys, 'argv', testargs):
         args = cli.parse_args(testargs)
     assert cli_utils.check_outputdir_status(args.output_dir) is True
+    # second check is cached
+    assert args.output_dir in cli_utils.WRITABLE_DIRS
+    assert cli_utils.check_outputdir_status(args.output_dir) is True
     # test fileslug for name
     filepath, destdir = cli_utils.determine_output_path(args, args.output_dir, '', new_filename='AAZZ')
     assert filepath.endswith('AAZZ.xml')
@@ -200,6 +234,11 @@ def test_sysoutput():
     args.keep_dirs = False
     filepath, destdir = cli_utils.determine_output_path(args, 'testfile.txt', '')
     assert filepath == 'test/uOHdo6wKo4IK0pkL.txt'
+    # arguments which did not go through map_args
+    del args.output_extension
+    args.output_format = 'xml'
+    filepath, destdir = cli_utils.determine_output_path(args, 'testfile.txt', '')
+    assert filepath == 'test/uOHdo6wKo4IK0pkL.xml'
 
 
 def test_download():
@@ -277,7 +316,8 @@ def test_cli_pipeline():
     testargs = ['', '--backup-dir', '/tmp/']
     with patch.object(sys, 'argv', testargs):
         args = cli.parse_args(testargs)
-    cli_utils.archive_html('00Test', args)
+    filename = cli_utils.archive_html('00Test', args)
+    assert len(filename) == settings.FILENAME_LEN and filename.isalnum()
     # test date-based exclusion
     testargs = ['', '-out', 'xml', '--only-with-metadata']
     with patch.object(sys, 'argv', testargs):
@@ -306,6 +346,45 @@ def test_cli_pipeline():
     # file processing pipeline on resources/
     args.input_dir = RESOURCES_DIR
     cli_utils.file_processing_pipeline(args)
+    # same with threaded reading and writing, results are identical
+    with tempfile.TemporaryDirectory() as default_dir, tempfile.TemporaryDirectory() as pipelined_dir:
+        args.output_dir = default_dir
+        cli_utils.file_processing_pipeline(args)
+        args.output_dir, args.pipeline = pipelined_dir, True
+        cli_utils.file_processing_pipeline(args)
+        assert len(os.listdir(pipelined_dir)) > 0
+        assert sorted(os.listdir(default_dir)) == sorted(os.listdir(pipelined_dir))
+        for filename in os.listdir(default_dir):
+            with open(os.path.join(default_dir, filename), 'rb') as file1, \
+                 open(os.path.join(pipelined_dir, filename), 'rb') as file2:
+                assert file1.read() == file2.read()
+    args.output_dir = None
+    # unreadable files and failing extractions do not stop the processing
+    with patch.object(cli_utils.path, 'getsize', side_effect=OSError):
+        cli_utils.file_processing_pipeline(args)
+    with patch.object(cli_utils, 'examine', failing_examine):
+        cli_utils.file_processing_pipeline(args)
+    # hanging extractions are stopped, the files queued behind them are processed
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_dir, args.output_dir = os.path.join(tmpdir, 'input'), os.path.join(tmpdir, 'output')
+        os.makedirs(input_dir)
+        for i, word in enumerate(['apples', 'pears', 'plums', 'cherries', 'peaches']):
+            with open(os.path.join(input_dir, f'{i}.html'), 'w', encoding='utf-8') as f:
+                f.write('<html><body><article>' + f'<p>This paragraph is about {word}.</p>' * 10 +
+                        ('<p>hanging document</p>' if i == 1 else '') + '</article></body></html>')
+        config = settings.use_config()
+        config['DEFAULT']['EXTRACTION_TIMEOUT'] = '2'
+        args.input_dir, args.config_file = input_dir, os.path.join(tmpdir, 'settings.cfg')
+        with open(args.config_file, 'w', encoding='utf-8') as f:
+            config.write(f)
+        start = time()
+        f = io.StringIO()
+        with patch.object(cli_utils, 'examine', sleeping_examine), patch.object(sys, 'stderr', f):
+            cli_utils.file_processing_pipeline(args)
+        assert time() - start < 30
+        assert f.getvalue().count('extraction timeout') == 1 and '1.html' in f.getvalue()
+        assert len(os.listdir(args.output_dir)) == 4
+    args.input_dir, args.output_dir, args.config_file = RESOURCES_DIR, None, None
     # sitemaps: tested in --explore
     testargs = ['', '--sitemap', 'https://sitemaps.org/sitemap.xml', '--list', '--parallel', '1']
     with patch.object(sys, 'argv', testargs):
@@ -334,6 +413,56 @@ def test_cli_pipeline():
     assert '[link](testlink.html)' in result and 'test.jpg' in result
 
 
+def test_discovery_downloads():
+    '''test downloads while link discovery is still running'''
+    calls = []
+    with open(os.path.join(RESOURCES_DIR, 'httpbin_sample.html'), encoding='utf-8') as f:
+        htmlstring = f.read()
+
+    def mock_discovery(url, target_lang=None, external=False):
+        if 'slow' in url:
+            sleep(1)
+        calls.append(('found', url, time()))
+        return [url.replace('feed', 'page')]
+
+    def mock_downloads(bufferlist, download_threads, decode=True, executor=None):
+        for url in bufferlist:
+            calls.append(('downloaded', url, time()))
+            # pages are missing, feeds are not
+            yield url, None if url.endswith('page') else htmlstring
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inputfile = os.path.join(tmpdir, 'input.txt')
+        with open(inputfile, 'w', encoding='utf-8') as f:
+            f.write('https://fast.example.org/feed\nhttps://slow.example.org/feed\n')
+        config = settings.use_config()
+        config['DEFAULT']['SLEEP_TIME'] = '0.2'
+        configfile = os.path.join(tmpdir, 'settings.cfg')
+        with open(configfile, 'w', encoding='utf-8') as f:
+            config.write(f)
+        testargs = ['', '-i', inputfile, '--feed', '--archived', '-o', os.path.join(tmpdir, 'out'), '--config-file', configfile]
+        with patch.object(sys, 'argv', testargs):
+            args = cli.parse_args(testargs)
+        with patch.object(cli_utils, 'find_feed_urls', mock_discovery), \
+             patch.object(cli_utils, 'buffered_downloads', mock_downloads), \
+             patch.object(cli_utils, 'MAX_FILES_PER_DIRECTORY', 2), \
+             patch.object(cli_utils, 'download_queue_processing', wraps=cli_utils.download_queue_processing) as queue:
+            assert cli_utils.cli_discovery(args) is True
+
+    times = {(action, url): timestamp for action, url, timestamp in calls}
+    # the first page is downloaded before the discovery is over
+    assert times[('downloaded', 'https://fast.example.org/page')] < times[('found', 'https://slow.example.org/feed')]
+    # the counter carries over: both feeds were written during discovery
+    assert queue.call_args_list[0][0][2] == 2
+    # so do the errors, all missing pages are retried in the archive
+    archived = [url for action, url in times if url.startswith('https://web.archive.org/')]
+    assert len(archived) == 2
+    assert any(u.endswith('fast.example.org/page') for u in archived)
+    assert any(u.endswith('slow.example.org/page') for u in archived)
+    # results processing
+    assert cli_utils.process_downloads([('https://example.org', None)], args, None, config) == (['https://example.org'], None)
+
+
 def test_input_filtering():
     '''test internal functions to filter urls'''
     testargs = ['']
@@ -385,6 +514,7 @@ def test_input_filtering():
     # double URLs
     args.input_file = os.path.join(RESOURCES_DIR, 'redundant-urls.txt')
     my_urls = cli_utils.load_input_urls(args)
+    assert len(my_urls) == 5 and all(u.startswith('http') for u in my_urls)
     url_store = add_to_compressed_dict(my_urls)
     assert len(url_store.find_known_urls('https://example.org')) == 1
 
@@ -473,6 +603,7 @@ if __name__ == '__main__':
     test_input_filtering()
     test_sysoutput()
     test_cli_pipeline()
+    test_discovery_downloads()
     test_crawling()
     test_download()
     test_probing()
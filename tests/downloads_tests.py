@@ -17,8 +17,17 @@ try:
 except ImportError:
     brotli = None
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
 import gzip
-from time import sleep
+import threading
+from contextlib import contextmanager
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
 from unittest.mock import Mock, patch
 
 from courlan import UrlStore
@@ -28,14 +37,18 @@ from trafilatura.cli_utils import (download_queue_processing,
                                    url_processing_pipeline)
 from trafilatura.core import extract
 from trafilatura.downloads import (DEFAULT_HEADERS, USER_AGENT,
-                                   _determine_headers, _handle_response,
-                                   _parse_config, _pycurl_is_live_page,
+                                   _determine_headers,
+                                   _handle_response, _parse_config,
+                                   _pycurl_is_live_page,
                                    _send_pycurl_request, _send_request,
                                    _urllib3_is_live_page,
-                                   add_to_compressed_dict, fetch_url,
-                                   is_live_page, load_download_buffer)
+                                   add_to_compressed_dict,
+                                   buffered_async_downloads, fetch_url,
+                                   is_live_page, load_download_buffer,
+                                   queued_async_downloads)
 from trafilatura.settings import DEFAULT_CONFIG, use_config
-from trafilatura.utils import decode_response, load_html
+from trafilatura.utils import (decode_response, detect_encoding, isutf8,
+                              load_html)
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
@@ -47,11 +60,41 @@ RESOURCES_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'resour
 UA_CONFIG = use_config(filename=os.path.join(RESOURCES_DIR, 'newsettings.cfg'))
 
 
+class QuietHandler(SimpleHTTPRequestHandler):
+    "Serve test files without logging each request, count the requests and connections."
+    protocol_version = 'HTTP/1.1'
+    requests = 0
+    connections = 0
+
+    def setup(self):
+        QuietHandler.connections += 1
+        super().setup()
+
+    def do_GET(self):
+        QuietHandler.requests += 1
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def local_server():
+    "Serve the test resources on a local port."
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=RESOURCES_DIR))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 def test_fetch():
     '''Test URL fetching.'''
     # logic: empty request?
     assert _send_request('', True, DEFAULT_CONFIG) is None
-
     # is_live general tests
     assert _urllib3_is_live_page('https://httpbun.com/status/301') is True
     assert _urllib3_is_live_page('https://httpbun.com/status/404') is False
@@ -130,6 +173,13 @@ def test_decode():
     if brotli is not None:
         brotli_string = brotli.compress(html_string.encode("utf-8"))
         assert decode_response(brotli_string) == html_string
+    # other encodings: UTF-8 is only tried once
+    assert detect_encoding(html_string.encode("utf-8")) == ['utf-8']
+    latin_string = "<html><head/><body><div>" + "Café crème à emporter. " * 10 + "</div></body></html>"
+    with patch('trafilatura.utils.isutf8', wraps=isutf8) as utf8_test:
+        result = decode_response(latin_string.encode("iso-8859-1"))
+    assert 'Café' in result and '\ufffd' not in result
+    assert utf8_test.call_count == 0
 
 
 def test_queue():
@@ -145,6 +195,55 @@ def test_queue():
     sleep(0.25)
     bufferlist, _ = load_download_buffer(url_store, sleep_time=0.1)
     assert len(bufferlist) == 6
+    # only wait until the next domain is available
+    sleep(0.5)
+    start = time()
+    bufferlist, _ = load_download_buffer(url_store, sleep_time=1)
+    assert len(bufferlist) == 6 and time() - start < 0.9
+    # asynchronous downloads (or threaded fallback)
+    assert list(buffered_async_downloads(['https://1234.yz/'], 2)) == [('https://1234.yz/', None)]
+    url_store = add_to_compressed_dict(['https://1234.yz/1', 'https://1234.yz/2', 'https://5678.yz/1'])
+    results = list(queued_async_downloads(url_store, 2, sleep_time=0.1))
+    assert len(results) == 3 and all(r is None for _, r in results)
+    assert url_store.done is True
+    # real content and early stop
+    with local_server() as base:
+        results = dict(buffered_async_downloads([base + '/httpbin_sample.html', base + '/missing.html'], 2))
+        assert 'Moby-Dick' in results[base + '/httpbin_sample.html']
+        assert results[base + '/missing.html'] is None
+        requests = QuietHandler.requests
+        downloads = buffered_async_downloads([base + f'/httpbin_sample.html?{i}' for i in range(50)], 1)
+        assert 'Moby-Dick' in next(downloads)[1]
+        # no download in advance while the result is being processed
+        if aiohttp is not None:
+            sleep(0.2)
+            assert QuietHandler.requests == requests + 1
+        downloads.close()
+        # no further requests once the consumer has stopped
+        requests = QuietHandler.requests
+        sleep(0.2)
+        assert QuietHandler.requests == requests < 50
+        # the queue keeps its download threads: one connection for successive buffers
+        testargs = ['', '--parallel', '1']
+        with patch.object(sys, 'argv', testargs):
+            args = parse_args(testargs)
+        config = use_config()
+        config['DEFAULT']['SLEEP_TIME'] = '0'
+        url_store = add_to_compressed_dict([base + f'/httpbin_sample.html?{i}' for i in range(3)])
+        connections = QuietHandler.connections
+        assert download_queue_processing(url_store, args, None, config) == ([], None)
+        assert QuietHandler.connections == connections + 1
+    # hosts visited shortly before are not requested again right away
+    if aiohttp is not None:
+        request_times = []
+        async def mock_request(session, url, no_ssl, config):
+            request_times.append(time())
+        url_store = add_to_compressed_dict(['https://1234.yz/1', 'https://1234.yz/2'])
+        url_store.get_url('https://1234.yz')
+        start = time()
+        with patch('trafilatura.downloads._send_async_request', mock_request):
+            results = list(queued_async_downloads(url_store, 2, sleep_time=0.5))
+        assert len(results) == 1 and request_times[0] - start >= 0.4
     # CLI args
     url_store = add_to_compressed_dict(['https://www.example.org/'])
     testargs = ['', '--list']
@@ -163,6 +262,11 @@ def test_queue():
     config['DEFAULT']['SLEEP_TIME'] = '0.2'
     results = download_queue_processing(url_store, args, None, config)
     assert len(results[0]) == 6 and results[1] is None
+    # same with asynchronous downloads
+    args.async_downloads = True
+    url_store = add_to_compressed_dict(inputurls)
+    results = download_queue_processing(url_store, args, None, config)
+    assert len(results[0]) == 6 and results[1] is None
 
 
 if __name__ == '__main__':
@@ -14,6 +14,7 @@ from trafilatura.feeds import (
     determine_feed,
     extract_links,
     find_feed_urls,
+    find_head_links,
     handle_link_list,
 )
 
@@ -244,6 +245,34 @@ def test_feeds_helpers():
         == 0
     )
 
+    # parsing stops after the head
+    assert find_head_links(
+        '<html><head><link rel="alternate" type="application/rss+xml" href="https://example.org/feed"/></head>'
+        '<body><link rel="alternate" href="https://example.org/other.rss"/>' + "<p>text</p>" * 10000 + "</body></html>"
+    ) == ["https://example.org/feed"]
+    assert find_head_links("<html><body><p>no feed</p></body></html>") == []
+    # feed links in the head take precedence over those in the body
+    assert determine_feed(
+        '<html><head><link rel="alternate" type="application/rss+xml" href="https://example.org/feed"/></head>'
+        '<body><link rel="alternate" type="application/rss+xml" href="https://example.org/other.rss"/></body></html>',
+        params,
+    ) == ["https://example.org/feed"]
+    # links in the body are used otherwise
+    assert determine_feed(
+        '<html><head><title>Test</title></head>'
+        '<body><link rel="alternate" type="application/rss+xml" href="https://example.org/other.rss"/></body></html>',
+        params,
+    ) == ["https://example.org/other.rss"]
+    # head links without target are ignored, the rest of the page is examined
+    assert find_head_links(
+        '<html><head><link rel="alternate" type="application/rss+xml"/></head><body/></html>'
+    ) == []
+    assert determine_feed(
+        '<html><head><link rel="alternate" type="application/rss+xml"/></head>'
+        '<body><a href="/rss"/></body></html>',
+        FeedParameters("https://example.org", "example.org", "https://example.org"),
+    ) == ["https://example.org/rss"]
+
     # detecting in <a>-elements
     params = FeedParameters("https://example.org", "example.org", "https://example.org")
     assert determine_feed(
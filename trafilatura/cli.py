@@ -12,28 +12,29 @@ import warnings
 from platform import python_version
 
 from . import __version__
-from .cli_utils import (cli_crawler, cli_discovery, examine,
-                        file_processing_pipeline, load_blacklist,
+from .cli_utils import (EXTENSION_MAPPING, cli_crawler, cli_discovery,
+                        examine, file_processing_pipeline, load_blacklist,
                         load_input_dict, probe_homepage,
                         url_processing_pipeline, write_result)
 from .settings import DOWNLOAD_THREADS
 
-# fix output encoding on some systems
-try:
-    # > Python 3.7
-    if sys.stdout.encoding != 'UTF-8':
-        sys.stdout.reconfigure(encoding='utf-8')
-    if sys.stderr.encoding != 'UTF-8':
-        sys.stderr.reconfigure(encoding='utf-8')
-except AttributeError:
-    import codecs
-    if sys.stdout.encoding != 'UTF-8':
-        sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
-    if sys.stderr.encoding != 'UTF-8':
-        sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+def _configure_stdio():
+    """Fix output encoding on some systems"""
+    try:
+        # > Python 3.7
+        if sys.stdout.encoding != 'UTF-8':
+            sys.stdout.reconfigure(encoding='utf-8')
+        if sys.stderr.encoding != 'UTF-8':
+            sys.stderr.reconfigure(encoding='utf-8')
+    except AttributeError:
+        import codecs
+        if sys.stdout.encoding != 'UTF-8':
+            sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+        if sys.stderr.encoding != 'UTF-8':
+            sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
 
 
-def parse_args(args):
+def _build_parser():
     """Define parser for command-line arguments"""
     parser = argparse.ArgumentParser(description='Command-line interface for Trafilatura')
     group1 = parser.add_argument_group('Input', 'URLs, files or directories to process')
@@ -64,6 +65,12 @@ def parse_args(args):
     group1.add_argument('--parallel',
                         help="specify a number of cores/threads for downloads and/or processing",
                         type=int, default=DOWNLOAD_THREADS)
+    group1.add_argument('--pipeline',
+                        help="overlap reading, extraction and writing of files in input directories",
+                        action="store_true")
+    group1.add_argument('--async-downloads',
+                        help="download web pages asynchronously (requires aiohttp)",
+                        action="store_true")
     group1.add_argument('-b', '--blacklist',
                         help="file containing unwanted URLs to discard during processing",
                         type=str)
@@ -188,10 +195,17 @@ def parse_args(args):
         action="version",
         version=f"Trafilatura {__version__} - Python {python_version()}",
     )
+    return parser
 
 
+# built once and reused for each call
+PARSER = _build_parser()
+
+
+def parse_args(args):
+    """Parse command-line arguments"""
     # wrap in mapping to prevent invalid input
-    return map_args(parser.parse_args())
+    return map_args(PARSER.parse_args())
 
 
 def map_args(args):
@@ -205,6 +219,8 @@ def map_args(args):
         args.output_format = 'xml'
     elif args.xmltei:
         args.output_format = 'xmltei'
+    # extension of output files, TXT by default
+    args.output_extension = EXTENSION_MAPPING.get(args.output_format, '.txt')
     # output configuration
     if args.nocomments is False:
         args.no_comments = False
@@ -259,6 +275,7 @@ def map_args(args):
 
 def main():
     """ Run as a command-line utility. """
+    _configure_stdio()
     args = parse_args(sys.argv[1:])
     process_args(args)
 
@@ -283,7 +300,7 @@ def process_args(args):
 
     # fetch urls from a feed or a sitemap
     elif args.explore or args.feed or args.sitemap:
-        cli_discovery(args)
+        error_caught = cli_discovery(args)
 
     # activate crawler/spider
     elif args.crawl:
@@ -304,11 +321,8 @@ def process_args(args):
 
     # read input on STDIN directly
     else:
-        # file type and unicode check
-        try:
-            htmlstring = sys.stdin.read()
-        except UnicodeDecodeError:
-            sys.exit('ERROR: system, file type or buffer encoding')
+        # raw bytes, encoding detection happens during parsing
+        htmlstring = sys.stdin.buffer.read()
         # process
         result = examine(htmlstring, args, url=args.URL)
         write_result(result, args)
@@ -13,34 +13,43 @@ import re
 import string
 import sys
 import traceback
-from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
-                                as_completed)
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from concurrent.futures.process import BrokenProcessPool
 from functools import partial
-from os import makedirs, path, walk
+from os import makedirs, path, scandir
 
 from courlan import UrlStore, extract_domain, get_base_url  # validate_url
 
 from trafilatura import spider
 
 from .core import extract, html2txt
-from .downloads import (add_to_compressed_dict, buffered_downloads,
-                        load_download_buffer)
+from .downloads import (add_to_compressed_dict, buffered_async_downloads,
+                        buffered_downloads, load_download_buffer,
+                        next_download_delay, queued_async_downloads)
 from .feeds import find_feed_urls
 from .filters import LANGID_FLAG, language_classifier
 from .hashing import generate_hash_filename
 from .meta import reset_caches
-from .settings import (FILE_PROCESSING_CORES, FILENAME_LEN,
-                       MAX_FILES_PER_DIRECTORY, use_config)
+from .settings import (FILE_PROCESSING_CORES, FILE_READING_THREADS,
+                       FILENAME_LEN, MAX_FILES_PER_DIRECTORY, use_config)
 from .sitemaps import sitemap_search
 from .utils import URL_BLACKLIST_REGEX, make_chunks, uniquify_list
 
 LOGGER = logging.getLogger(__name__)
 
-random.seed(345)  # make generated file names reproducible
+# make generated file names reproducible without touching the global state
+RANDOM_NAMES = random.Random(345)
 CHAR_CLASS = string.ascii_letters + string.digits
 
+# directories known to be writable, no need to check them for each file
+WRITABLE_DIRS = set()
+
 STRIP_DIR = re.compile(r'[^/]+$')
 STRIP_EXTENSION = re.compile(r'\.[a-z]{2,5}$')
+# anchored and case-insensitive, discards strings such as "httpsomething"
+URL_PREFIX = re.compile(r'https?://', re.I).match
 
 INPUT_URLS_ARGS = ['URL', 'crawl', 'explore', 'probe', 'feed', 'sitemap']
 
@@ -60,7 +69,10 @@ def load_input_urls(args):
         try:
             # optional: errors='strict', buffering=1
             with open(args.input_file, mode='r', encoding='utf-8') as inputfile:
-                input_urls.extend(line.strip() for line in inputfile)
+                # cheap prefix test first, discard empty lines and other strings
+                input_urls.extend(
+                    url for url in map(str.strip, inputfile) if URL_PREFIX(url)
+                )
         except UnicodeDecodeError:
             sys.exit('ERROR: system, file type or buffer encoding')
     else:
@@ -100,6 +112,8 @@ def load_input_dict(args):
 
 def check_outputdir_status(directory):
     '''Check if the output directory is within reach and writable'''
+    if directory in WRITABLE_DIRS:
+        return True
     # check the directory status
     if not path.exists(directory) or not path.isdir(directory):
         try:
@@ -111,6 +125,7 @@ def check_outputdir_status(directory):
             sys.stderr.write('ERROR: Destination directory cannot be created: ' + directory + '\n')
             # raise OSError()
             return False
+    WRITABLE_DIRS.add(directory)
     return True
 
 
@@ -125,7 +140,7 @@ def determine_counter_dir(dirname, counter):
 
 def generate_filename():
     '''Generate a random filename of the desired length'''
-    return ''.join(random.choice(CHAR_CLASS) for _ in range(FILENAME_LEN))
+    return ''.join(RANDOM_NAMES.choices(CHAR_CLASS, k=FILENAME_LEN))
 
 
 def get_writable_path(destdir, extension):
@@ -139,9 +154,6 @@ def get_writable_path(destdir, extension):
 
 def determine_output_path(args, orig_filename, content, counter=None, new_filename=None):
     '''Pick a directory based on selected options and a file name based on output type'''
-    # determine extension, TXT by default
-    extension = EXTENSION_MAPPING.get(args.output_format, '.txt')
-
     if args.keep_dirs:
         # strip directory
         original_dir = STRIP_DIR.sub('', orig_filename)
@@ -153,6 +165,8 @@ def determine_output_path(args, orig_filename, content, counter=None, new_filena
         # use cryptographic hash on file contents to define name
         filename = new_filename or generate_hash_filename(content)
 
+    # extension determined once while mapping the arguments, if available
+    extension = getattr(args, 'output_extension', None) or EXTENSION_MAPPING.get(args.output_format, '.txt')
     output_path = path.join(destination_dir, filename + extension)
     return output_path, destination_dir
 
@@ -175,7 +189,9 @@ def write_result(result, args, orig_filename=None, counter=None, new_filename=No
     if result is None:
         return
     if args.output_dir is None:
-        sys.stdout.write(result + '\n')
+        # no concatenation, it would copy the whole result
+        sys.stdout.write(result)
+        sys.stdout.write('\n')
     else:
         destination_path, destination_dir = determine_output_path(args, orig_filename, result, counter, new_filename)
         # check the directory status
@@ -186,15 +202,59 @@ def write_result(result, args, orig_filename=None, counter=None, new_filename=No
 
 def generate_filelist(inputdir):
     '''Walk the directory tree and output all file names'''
-    for root, _, inputfiles in walk(inputdir):
-        for fname in inputfiles:
-            yield path.join(root, fname)
+    # scandir entries cache file type information, no further system call needed
+    try:
+        with scandir(inputdir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from generate_filelist(entry.path)
+                elif entry.is_file():
+                    yield entry.path
+    except OSError as err:
+        # not a directory or no permission, skipped like with os.walk
+        LOGGER.debug('cannot list directory: %s %s', inputdir, err)
+
+
+def read_file(filename, config):
+    '''Read a file in a list and return its name along with its content,
+       files outside of the size limits are skipped without being read'''
+    max_size = config.getint('DEFAULT', 'MAX_FILE_SIZE')
+    try:
+        filesize = path.getsize(filename)
+        if filesize > max_size:
+            sys.stderr.write(f'ERROR: file too large: {filename}\n')
+            return filename, None
+        if filesize < config.getint('DEFAULT', 'MIN_FILE_SIZE'):
+            sys.stderr.write(f'ERROR: file too small: {filename}\n')
+            return filename, None
+        # the file could have grown in the meantime
+        with open(filename, 'rb') as inputf:
+            htmlstring = inputf.read(max_size + 1)
+    # e.g. file removed or not readable
+    except OSError as err:
+        sys.stderr.write(f'ERROR: cannot read file: {filename} {err}\n')
+        return filename, None
+    return filename, htmlstring
+
+
+def prefetch_files(executor, filenames, size, config):
+    '''Read files in background threads, up to a given number in advance'''
+    queue = deque()
+    for filename in filenames:
+        queue.append(executor.submit(read_file, filename, config))
+        if len(queue) >= size:
+            yield queue.popleft().result()
+    while queue:
+        yield queue.popleft().result()
 
 
 def file_processing(filename, args, counter=None, config=None):
     '''Aggregated functions to process a file in a list'''
-    with open(filename, 'rb') as inputf:
-        htmlstring = inputf.read()
+    if config is None:
+        config = use_config(filename=args.config_file)
+    _, htmlstring = read_file(filename, config)
+    if htmlstring is None:
+        return
     result = examine(htmlstring, args, url=args.URL, config=config)
     write_result(result, args, filename, counter, new_filename=None)
 
@@ -212,20 +272,35 @@ def process_result(htmlstring, args, url, counter, config):
     return counter
 
 
+def process_downloads(downloads, args, counter, config):
+    '''Process the results of a series of downloads and list the missing ones'''
+    errors = []
+    for url, result in downloads:
+        # handle result
+        if result is not None:
+            counter = process_result(result, args, url, counter, config)
+        else:
+            LOGGER.warning('No result for URL: %s', url)
+            errors.append(url)
+    return errors, counter
+
+
 def download_queue_processing(url_store, args, counter, config):
     '''Implement a download queue consumer, single- or multi-threaded'''
     sleep_time = config.getfloat('DEFAULT', 'SLEEP_TIME')
     errors = []
-    while url_store.done is False:
-        bufferlist, url_store = load_download_buffer(url_store, sleep_time)
-        # process downloads
-        for url, result in buffered_downloads(bufferlist, args.parallel):
-            # handle result
-            if result is not None:
-                counter = process_result(result, args, url, counter, config)
+    # same threads for the whole queue: connections to a host can be reused
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        while url_store.done is False:
+            # process downloads
+            if args.async_downloads:
+                # one queue per host, no waiting between distinct hosts
+                downloads = queued_async_downloads(url_store, args.parallel, sleep_time, config=config)
             else:
-                LOGGER.warning('No result for URL: %s', url)
-                errors.append(url)
+                bufferlist, url_store = load_download_buffer(url_store, sleep_time)
+                downloads = buffered_downloads(bufferlist, args.parallel, executor=executor)
+            new_errors, counter = process_downloads(downloads, args, counter, config)
+            errors.extend(new_errors)
     return errors, counter
 
 
@@ -236,24 +311,44 @@ def cli_discovery(args):
     input_urls = url_store.dump_urls()
     if args.list:
         url_store.reset()
-    ext = use_config(filename=args.config_file).getboolean('DEFAULT', 'EXTERNAL_URLS')
+    config = use_config(filename=args.config_file)
+    ext = config.getboolean('DEFAULT', 'EXTERNAL_URLS')
+    sleep_time = config.getfloat('DEFAULT', 'SLEEP_TIME')
+    eager_downloads = not args.list
+    counter, errors = None, []
 
     # link discovery and storage
-    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
-        futures = (executor.submit(func, url, target_lang=args.target_language, external=ext) for url in input_urls)
-        # process results from the parallel threads and add them
-        # to the compressed URL dictionary for further processing
-        for future in as_completed(futures):
-            if future.result() is not None:
-                url_store.add_urls(future.result())
-                # empty buffer in order to spare memory
-                if args.sitemap and args.list and len(url_store.get_known_domains()) >= args.parallel:
-                    url_store.print_unvisited_urls()
-                    url_store.reset()
-                    reset_caches()
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor, \
+         ThreadPoolExecutor(max_workers=args.parallel) as downloader:
+        pending = {executor.submit(func, url, target_lang=args.target_language, external=ext) for url in input_urls}
+        while pending:
+            # wake up when a discovery is finished or when a domain can be visited again
+            timeout = next_download_delay(url_store, sleep_time) if eager_downloads else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            # process results from the parallel threads and add them
+            # to the compressed URL dictionary for further processing
+            for future in done:
+                if future.result() is not None:
+                    url_store.add_urls(future.result())
+                    # empty buffer in order to spare memory
+                    if args.sitemap and args.list and len(url_store.get_known_domains()) >= args.parallel:
+                        url_store.print_unvisited_urls()
+                        url_store.reset()
+                        reset_caches()
+            # download the links which are available while discovery goes on
+            if eager_downloads and pending:
+                if counter is None and url_store.total_url_number() > MAX_FILES_PER_DIRECTORY:
+                    counter = 0
+                bufferlist = url_store.get_download_urls(timelimit=sleep_time)
+                if args.async_downloads:
+                    downloads = buffered_async_downloads(bufferlist, args.parallel, config=config)
+                else:
+                    downloads = buffered_downloads(bufferlist, args.parallel, executor=downloader)
+                new_errors, counter = process_downloads(downloads, args, counter, config)
+                errors.extend(new_errors)
 
     # process the (rest of the) links found
-    error_caught = url_processing_pipeline(args, url_store)
+    error_caught = url_processing_pipeline(args, url_store, counter, errors)
 
     # activate site explorer
     if args.explore:
@@ -261,6 +356,8 @@ def cli_discovery(args):
         control_dict = build_exploration_dict(url_store, input_urls, args)
         cli_crawler(args, url_store=control_dict)
 
+    return error_caught
+
 
 def build_exploration_dict(url_store, input_urls, args):
     "Find domains for which nothing has been found and add info to the crawl dict."
@@ -331,8 +428,9 @@ def probe_homepage(args):
                     print(url, flush=True)
 
 
-def url_processing_pipeline(args, url_store):
-    '''Aggregated functions to show a list and download and process an input list'''
+def url_processing_pipeline(args, url_store, counter=None, errors=None):
+    '''Aggregated functions to show a list and download and process an input list,
+       optionally continuing from a file counter and errors of previous downloads'''
     # print list without further processing
     if args.list:
         url_store.print_unvisited_urls()  # and not write_result()
@@ -340,12 +438,11 @@ def url_processing_pipeline(args, url_store):
     # parse config
     config = use_config(filename=args.config_file)
     # initialize file counter if necessary
-    if url_store.total_url_number() > MAX_FILES_PER_DIRECTORY:
+    if counter is None and url_store.total_url_number() > MAX_FILES_PER_DIRECTORY:
         counter = 0
-    else:
-        counter = None
     # download strategy
-    errors, counter = download_queue_processing(url_store, args, counter, config)
+    new_errors, counter = download_queue_processing(url_store, args, counter, config)
+    errors = (errors or []) + new_errors
     LOGGER.debug('%s URLs could not be found', len(errors))
     # option to retry
     if args.archived is True:
@@ -360,6 +457,89 @@ def url_processing_pipeline(args, url_store):
     return bool(errors)
 
 
+def write_finished_results(futures, pending, args, counter):
+    '''Write the results of finished extractions and remove them from the pending ones'''
+    for future in futures:
+        filename, _ = pending.pop(future)
+        try:
+            result = future.result()
+        # a single file should not stop the processing, e.g. BrokenProcessPool
+        except Exception as err:
+            sys.stderr.write(f'ERROR: {filename} {err}\n')
+        else:
+            write_result(result, args, filename, counter)
+
+
+def restart_processes(executor, processing_cores):
+    '''Terminate the extraction processes, including hanging ones, and start new ones'''
+    # the list of processes is discarded on shutdown
+    processes = list((executor._processes or {}).values())
+    executor.shutdown(wait=False)
+    for process in processes:
+        process.terminate()
+    return ProcessPoolExecutor(max_workers=processing_cores)
+
+
+def wait_for_results(executor, pending, args, counter, config, timeout, limit=0):
+    '''Write finished results until no more than the given number of extractions
+       are pending. If none finishes in time the running ones are abandoned,
+       the processes are replaced and the queued files are submitted again.'''
+    processing_cores = executor._max_workers
+    while len(pending) > limit:
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            # tasks are started in order, one more can be marked as running:
+            # the first ones have been blocking the workers during the whole wait
+            running = [future for future in pending if future.running()][:processing_cores]
+            for future in running:
+                filename, _ = pending.pop(future)
+                sys.stderr.write(f'ERROR: extraction timeout: {filename}\n')
+            LOGGER.error('restarting extraction processes')
+            executor = restart_processes(executor, processing_cores)
+            queued = list(pending.values())
+            pending.clear()
+            for filename, htmlstring in queued:
+                future = executor.submit(examine, htmlstring, args, args.URL, config)
+                pending[future] = (filename, htmlstring)
+        write_finished_results(done, pending, args, counter)
+    return executor
+
+
+def pipelined_file_processing(args, processing_cores, config, timeout=None):
+    '''Read files in threads, extract in separate processes and write the results
+       as they arrive, so that disk access and extraction overlap'''
+    filecounter = None
+    # bounded queue: reading pauses if extraction lags behind
+    queue_size = 2 * processing_cores
+    executor = ProcessPoolExecutor(max_workers=processing_cores)
+    try:
+        with ThreadPoolExecutor(max_workers=FILE_READING_THREADS) as readers:
+            for filebatch in make_chunks(generate_filelist(args.input_dir), MAX_FILES_PER_DIRECTORY):
+                if filecounter is None and len(filebatch) >= MAX_FILES_PER_DIRECTORY:
+                    filecounter = 0
+                pending = {}
+                for filename, htmlstring in prefetch_files(readers, filebatch, queue_size, config):
+                    if htmlstring is None:
+                        continue
+                    try:
+                        future = executor.submit(examine, htmlstring, args, args.URL, config)
+                    except BrokenProcessPool:
+                        # a worker was terminated abruptly, start new ones
+                        LOGGER.error('restarting extraction processes')
+                        executor = restart_processes(executor, processing_cores)
+                        future = executor.submit(examine, htmlstring, args, args.URL, config)
+                    # content kept until the extraction is done in case it has to be restarted
+                    pending[future] = (filename, htmlstring)
+                    if len(pending) >= queue_size:
+                        executor = wait_for_results(executor, pending, args, filecounter, config, timeout, queue_size - 1)
+                executor = wait_for_results(executor, pending, args, filecounter, config, timeout)
+                # update counter
+                if filecounter is not None:
+                    filecounter += len(filebatch)
+    finally:
+        executor.shutdown()
+
+
 def file_processing_pipeline(args):
     '''Define batches for parallel file processing and perform the extraction'''
     filecounter = None
@@ -367,6 +547,10 @@ def file_processing_pipeline(args):
     config = use_config(filename=args.config_file)
     timeout = config.getint('DEFAULT', 'EXTRACTION_TIMEOUT') or None
 
+    if args.pipeline:
+        pipelined_file_processing(args, processing_cores, config, timeout)
+        return
+
     # max_tasks_per_child available in Python >= 3.11
     with ProcessPoolExecutor(max_workers=processing_cores) as executor:
         # chunk input: https://github.com/python/cpython/issues/74028
@@ -374,7 +558,10 @@ def file_processing_pipeline(args):
             if filecounter is None and len(filebatch) >= MAX_FILES_PER_DIRECTORY:
                 filecounter = 0
             worker = partial(file_processing, args=args, counter=filecounter, config=config)
-            executor.map(worker, filebatch, chunksize=10, timeout=timeout)
+            # send several files per task to reduce inter-process communication,
+            # same heuristic as multiprocessing.Pool.map
+            chunksize = max(1, len(filebatch) // (processing_cores * 4))
+            executor.map(worker, filebatch, chunksize=chunksize, timeout=timeout)
             # update counter
             if filecounter is not None:
                 filecounter += len(filebatch)
@@ -4,10 +4,15 @@ All functions needed to steer and execute downloads of web documents.
 """
 
 
+import asyncio
 import logging
 import random
+import ssl
 from collections import namedtuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from queue import Queue
+from threading import Thread, local
 from time import sleep
 
 import certifi
@@ -21,9 +26,16 @@ try:
     CURL_SHARE.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
     # not thread-safe
     # CURL_SHARE.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+    # one handle per thread instead, so that connections are kept alive
+    CURL_HANDLES = local()
 except ImportError:
     pycurl = None
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
 import urllib3
 from courlan import UrlStore
 from courlan.network import redirection_test
@@ -34,7 +46,7 @@ except ImportError:
     from importlib_metadata import version
 
 
-from .settings import DEFAULT_CONFIG
+from .settings import DEFAULT_CONFIG, DOWNLOAD_THREADS
 from .utils import (URL_BLACKLIST_REGEX, decode_response, make_chunks,
                     uniquify_list)
 
@@ -43,6 +55,8 @@ LOGGER = logging.getLogger(__name__)
 PKG_VERSION = version("trafilatura")
 
 NUM_CONNECTIONS = 50
+# idle connections kept alive per host
+POOL_MAXSIZE = DOWNLOAD_THREADS
 MAX_REDIRECTS = 2
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -105,13 +119,13 @@ def _send_request(url, no_ssl, config):
         if no_ssl is False:
             # define pool
             if not HTTP_POOL:
-                HTTP_POOL = urllib3.PoolManager(retries=RETRY_STRATEGY, timeout=config.getint('DEFAULT', 'DOWNLOAD_TIMEOUT'), ca_certs=certifi.where(), num_pools=NUM_CONNECTIONS)  # cert_reqs='CERT_REQUIRED'
+                HTTP_POOL = urllib3.PoolManager(retries=RETRY_STRATEGY, timeout=config.getint('DEFAULT', 'DOWNLOAD_TIMEOUT'), ca_certs=certifi.where(), num_pools=NUM_CONNECTIONS, maxsize=POOL_MAXSIZE)  # cert_reqs='CERT_REQUIRED'
             # execute request
             response = HTTP_POOL.request('GET', url, headers=_determine_headers(config))
         else:
             # define pool
             if not NO_CERT_POOL:
-                NO_CERT_POOL = urllib3.PoolManager(retries=RETRY_STRATEGY, timeout=config.getint('DEFAULT', 'DOWNLOAD_TIMEOUT'), cert_reqs='CERT_NONE', num_pools=NUM_CONNECTIONS)
+                NO_CERT_POOL = urllib3.PoolManager(retries=RETRY_STRATEGY, timeout=config.getint('DEFAULT', 'DOWNLOAD_TIMEOUT'), cert_reqs='CERT_NONE', num_pools=NUM_CONNECTIONS, maxsize=POOL_MAXSIZE)
             # execute request
             response = NO_CERT_POOL.request('GET', url, headers=_determine_headers(config))
     except urllib3.exceptions.SSLError:
@@ -169,10 +183,22 @@ def fetch_url(url, decode=True, no_ssl=False, config=DEFAULT_CONFIG):
     return None
 
 
+def _get_curl_handle():
+    "Reuse the curl handle of the current thread: options are reset but live connections are kept."
+    curl = getattr(CURL_HANDLES, 'curl', None)
+    if curl is None:
+        curl = CURL_HANDLES.curl = pycurl.Curl()
+        # share data, kept across resets
+        curl.setopt(pycurl.SHARE, CURL_SHARE)
+    else:
+        curl.reset()
+    return curl
+
+
 def _pycurl_is_live_page(url):
     "Send a basic HTTP HEAD request with pycurl."
     # Initialize pycurl object
-    curl = pycurl.Curl()
+    curl = _get_curl_handle()
     # Set the URL and HTTP method (HEAD)
     curl.setopt(pycurl.URL, url.encode('utf-8'))
     curl.setopt(pycurl.CONNECTTIMEOUT, 10)
@@ -188,10 +214,7 @@ def _pycurl_is_live_page(url):
         LOGGER.debug('pycurl HEAD error: %s %s', url, err)
         return False
     # Get the response code
-    page_exists = curl.getinfo(curl.RESPONSE_CODE) < 400
-    # Clean up
-    curl.close()
-    return page_exists
+    return curl.getinfo(curl.RESPONSE_CODE) < 400
 
 
 def _urllib3_is_live_page(url):
@@ -232,6 +255,17 @@ def add_to_compressed_dict(inputlist, blacklist=None, url_filter=None, url_store
     return url_store
 
 
+def next_download_delay(url_store, sleep_time):
+    '''Determine how long to wait until the first domain can be visited again.'''
+    now = datetime.now()
+    delays = [sleep_time]
+    for domain in url_store.get_unvisited_domains():
+        timestamp = url_store.urldict[domain].timestamp
+        if timestamp is not None:
+            delays.append(sleep_time - (now - timestamp).total_seconds())
+    return max(min(delays), 0)
+
+
 def load_download_buffer(url_store, sleep_time=5):
     '''Determine threading strategy and draw URLs respecting domain-based back-off rules.'''
     bufferlist = []
@@ -241,18 +275,183 @@ def load_download_buffer(url_store, sleep_time=5):
         if not bufferlist:
             if url_store.done is True:
                 break
-            sleep(sleep_time)
+            # only wait as long as necessary for the next domain
+            sleep(next_download_delay(url_store, sleep_time))
     return bufferlist, url_store
 
 
-def buffered_downloads(bufferlist, download_threads, decode=True):
-    '''Download queue consumer, single- or multi-threaded.'''
-    with ThreadPoolExecutor(max_workers=download_threads) as executor:
-        for chunk in make_chunks(bufferlist, 10000):
-            future_to_url = {executor.submit(fetch_url, url, decode): url for url in chunk}
-            for future in as_completed(future_to_url):
-                # url and download result
-                yield future_to_url[future], future.result()
+def buffered_downloads(bufferlist, download_threads, decode=True, executor=None):
+    '''Download queue consumer, single- or multi-threaded.
+       An existing thread pool can be passed along so that the threads
+       and their connections are kept from one buffer to the next.'''
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=download_threads) as executor:
+            yield from buffered_downloads(bufferlist, download_threads, decode, executor)
+        return
+    for chunk in make_chunks(bufferlist, 10000):
+        future_to_url = {executor.submit(fetch_url, url, decode): url for url in chunk}
+        for future in as_completed(future_to_url):
+            # url and download result
+            yield future_to_url[future], future.result()
+
+
+async def _send_async_request(session, url, no_ssl, config):
+    "Internal coroutine to send a request with aiohttp (SSL or not) and return its result."
+    # certificates are checked by the connector unless disabled
+    options = {'ssl': False} if no_ssl else {}
+    try:
+        async with session.get(
+            url,
+            headers=_determine_headers(config),
+            max_redirects=MAX_REDIRECTS,
+            **options,
+        ) as response:
+            data = await response.read()
+    except aiohttp.ClientSSLError:
+        if no_ssl is False:
+            LOGGER.warning('retrying after SSLError: %s', url)
+            return await _send_async_request(session, url, True, config)
+        LOGGER.error('download error: %s SSLError', url)
+    except Exception as err:
+        LOGGER.error('download error: %s %s', url, err)
+    else:
+        # necessary for standardization
+        return RawResponse(data, response.status, str(response.url))
+    # catchall
+    return None
+
+
+async def _limited_async_request(session, semaphore, url, config, results):
+    """Internal coroutine to download a URL within the concurrency limit and queue the result,
+       the slot is released by the consumer so that unprocessed pages do not pile up."""
+    await semaphore.acquire()
+    response = await _send_async_request(session, url, False, config)
+    results.put((url, response, semaphore.release))
+
+
+def _create_session(config):
+    "Internal function to set up an aiohttp session, to be called within the event loop."
+    connector = aiohttp.TCPConnector(
+        limit_per_host=2,
+        ssl=ssl.create_default_context(cafile=certifi.where()),
+    )
+    timeout = aiohttp.ClientTimeout(total=config.getint('DEFAULT', 'DOWNLOAD_TIMEOUT'))
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def _async_downloads(bufferlist, download_threads, config, results):
+    "Internal coroutine to download all URLs of a buffer concurrently."
+    semaphore = asyncio.Semaphore(download_threads)
+    try:
+        async with _create_session(config) as session:
+            await asyncio.gather(
+                *(_limited_async_request(session, semaphore, url, config, results) for url in bufferlist)
+            )
+    finally:
+        # signal that the buffer is exhausted
+        results.put(None)
+
+
+async def _host_downloads(session, semaphore, url_store, domain, sleep_time, config, results):
+    "Internal coroutine to download the URLs of a single host one after another."
+    # politeness: the host could have been visited shortly before
+    timestamp = url_store.urldict[domain].timestamp
+    if timestamp is not None:
+        await asyncio.sleep(max(sleep_time - (datetime.now() - timestamp).total_seconds(), 0))
+    url = url_store.get_url(domain)
+    while url is not None:
+        await _limited_async_request(session, semaphore, url, config, results)
+        url = url_store.get_url(domain)
+        # politeness: wait before the next request to the same host only
+        if url is not None:
+            await asyncio.sleep(sleep_time)
+
+
+async def _async_queue_downloads(url_store, download_threads, sleep_time, config, results):
+    "Internal coroutine to download all URLs in store with one worker per host."
+    semaphore = asyncio.Semaphore(download_threads)
+    try:
+        async with _create_session(config) as session:
+            await asyncio.gather(
+                *(_host_downloads(session, semaphore, url_store, domain, sleep_time, config, results)
+                  for domain in url_store.get_unvisited_domains())
+            )
+    finally:
+        # signal that the queue is exhausted
+        results.put(None)
+
+
+def _run_event_loop(loop, task):
+    "Run a task until it is complete or cancelled, then close the event loop."
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+def _call_in_loop(loop, callback):
+    "Schedule a callback from another thread unless the event loop is already closed."
+    try:
+        loop.call_soon_threadsafe(callback)
+    except RuntimeError:
+        pass
+
+
+def _consume_async_results(coroutine, results, decode, config):
+    "Run the event loop in a separate thread and yield the results as they arrive."
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(coroutine)
+    # results can be processed while the other downloads are still in flight
+    worker = Thread(target=_run_event_loop, args=(loop, task), daemon=True)
+    worker.start()
+    try:
+        for url, response, release in iter(results.get, None):
+            if response is not None:
+                yield url, _handle_response(url, response, decode, config)
+            else:
+                yield url, None
+            # backpressure: the next download starts once the result has been processed
+            _call_in_loop(loop, release)
+    finally:
+        # stop the remaining downloads if the results are not consumed until the end
+        if worker.is_alive():
+            _call_in_loop(loop, task.cancel)
+        worker.join()
+
+
+def buffered_async_downloads(bufferlist, download_threads, decode=True, config=DEFAULT_CONFIG):
+    '''Download queue consumer using asyncio and aiohttp (if installed),
+       results are yielded as soon as they arrive.'''
+    if aiohttp is None:
+        LOGGER.warning('aiohttp not installed, falling back to threaded downloads')
+        yield from buffered_downloads(bufferlist, download_threads, decode)
+        return
+    results = Queue()
+    yield from _consume_async_results(
+        _async_downloads(bufferlist, download_threads, config, results),
+        results, decode, config
+    )
+
+
+def queued_async_downloads(url_store, download_threads, sleep_time=5, decode=True, config=DEFAULT_CONFIG):
+    '''Download all URLs in store using asyncio and aiohttp (if installed):
+       requests to the same host are spaced by the sleep time while
+       distinct hosts are processed in parallel.'''
+    if aiohttp is None:
+        LOGGER.warning('aiohttp not installed, falling back to threaded downloads')
+        with ThreadPoolExecutor(max_workers=download_threads) as executor:
+            while url_store.done is False:
+                bufferlist, url_store = load_download_buffer(url_store, sleep_time)
+                yield from buffered_downloads(bufferlist, download_threads, decode, executor)
+        return
+    results = Queue()
+    yield from _consume_async_results(
+        _async_queue_downloads(url_store, download_threads, sleep_time, config, results),
+        results, decode, config
+    )
 
 
 def _send_pycurl_request(url, no_ssl, config):
@@ -268,10 +467,8 @@ def _send_pycurl_request(url, no_ssl, config):
 
     # prepare curl request
     # https://curl.haxx.se/libcurl/c/curl_easy_setopt.html
-    curl = pycurl.Curl()
+    curl = _get_curl_handle()
     curl.setopt(pycurl.URL, url.encode('utf-8'))
-    # share data
-    curl.setopt(pycurl.SHARE, CURL_SHARE)
     curl.setopt(pycurl.HTTPHEADER, headerlist)
     # curl.setopt(pycurl.USERAGENT, '')
     curl.setopt(pycurl.FOLLOWLOCATION, 1)
@@ -323,7 +520,4 @@ def _send_pycurl_request(url, no_ssl, config):
     effective_url = curl.getinfo(curl.EFFECTIVE_URL)
     # additional info
     # ip_info = curl.getinfo(curl.PRIMARY_IP)
-
-    # tidy up
-    curl.close()
     return RawResponse(bufferbytes, respcode, effective_url)
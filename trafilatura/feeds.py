@@ -10,7 +10,9 @@ import logging
 import re
 
 from itertools import islice
-from typing import List, Optional
+from typing import Any, List, Optional
+
+from lxml.etree import HTMLParser, LxmlError
 
 from courlan import (
     check_url,
@@ -70,6 +72,37 @@ LINK_VALIDATION_RE = re.compile(
     r"feed$"  # Generic
 )
 
+# size of the chunks fed to the parser when looking for links in the head
+HEAD_CHUNK_SIZE = 2**16
+
+
+class _HeadParsed(Exception):
+    "Raised by the parser target to stop parsing after the head section."
+
+
+class _HeadLinkTarget:
+    "Parser target collecting alternate links in the head section."
+    __slots__ = ["links"]
+
+    def __init__(self) -> None:
+        self.links: List[str] = []
+
+    def start(self, tag: str, attrib: Any) -> None:
+        "Keep links which look like feeds."
+        if tag == "link" and attrib.get("rel") == "alternate" and "href" in attrib:
+            href = attrib["href"]
+            if attrib.get("type") in FEED_TYPES or LINK_VALIDATION_RE.search(href):
+                self.links.append(href)
+
+    def end(self, tag: str) -> None:
+        "Abort parsing once the head is complete."
+        if tag == "head":
+            raise _HeadParsed
+
+    def close(self) -> List[str]:
+        "Return the links found."
+        return self.links
+
 
 class FeedParameters:
     "Store necessary information to proceed a feed."
@@ -176,28 +209,43 @@ def extract_links(feed_string: str, params: FeedParameters) -> List[str]:
     return output_links
 
 
+def find_head_links(htmlstring: str) -> List[str]:
+    """Look for feed links in the head without building the whole tree."""
+    target = _HeadLinkTarget()
+    parser = HTMLParser(target=target)
+    try:
+        for i in range(0, len(htmlstring), HEAD_CHUNK_SIZE):
+            parser.feed(htmlstring[i : i + HEAD_CHUNK_SIZE])
+        parser.close()
+    except (_HeadParsed, LxmlError):
+        pass
+    return target.links
+
+
 def determine_feed(htmlstring: str, params: FeedParameters) -> List[str]:
     """Try to extract the feed URL from the home page.
     Adapted from http://www.aaronsw.com/2002/feedfinder/"""
-    # parse the page to look for feeds
-    tree = load_html(htmlstring)
-    # safeguard
-    if tree is None:
-        LOGGER.debug("Invalid HTML/Feed page: %s", params.base)
-        return []
-    feed_urls = []
-    for linkelem in tree.xpath('//link[@rel="alternate"][@href]'):
-        # most common case + websites like geo.de
-        if (
-            "type" in linkelem.attrib and linkelem.get("type") in FEED_TYPES
-        ) or LINK_VALIDATION_RE.search(linkelem.get("href", "")):
-            feed_urls.append(linkelem.get("href"))
-    # backup
+    # most common case + websites like geo.de: feed links in the head,
+    # if there are any the rest of the document is not examined
+    feed_urls = find_head_links(htmlstring)
+    # otherwise parse the whole page to look for feeds
     if not feed_urls:
-        for linkelem in tree.xpath("//a[@href]"):
-            link = linkelem.get("href", "")
-            if LINK_VALIDATION_RE.search(link):
-                feed_urls.append(link)
+        tree = load_html(htmlstring)
+        # safeguard
+        if tree is None:
+            LOGGER.debug("Invalid HTML/Feed page: %s", params.base)
+            return []
+        for linkelem in tree.xpath('//link[@rel="alternate"][@href]'):
+            if (
+                "type" in linkelem.attrib and linkelem.get("type") in FEED_TYPES
+            ) or LINK_VALIDATION_RE.search(linkelem.get("href", "")):
+                feed_urls.append(linkelem.get("href"))
+        # backup
+        if not feed_urls:
+            for linkelem in tree.xpath("//a[@href]"):
+                link = linkelem.get("href", "")
+                if LINK_VALIDATION_RE.search(link):
+                    feed_urls.append(link)
     # refine
     output_urls = []
     for link in uniquify_list(feed_urls):
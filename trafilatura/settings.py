@@ -36,6 +36,7 @@ LRU_SIZE = 4096
 MAX_FILES_PER_DIRECTORY = 1000
 FILENAME_LEN = 8
 FILE_PROCESSING_CORES = min(cpu_count(), 16)  # 16 processes at most
+FILE_READING_THREADS = 8
 
 # Network
 MAX_LINKS = 10**6
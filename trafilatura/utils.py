@@ -108,11 +108,12 @@ def isutf8(data):
     return True
 
 
-def detect_encoding(bytesobject):
-    """"Read all input or first chunk and return a list of encodings"""
+def detect_encoding(bytesobject, test_utf8=True):
+    """"Read all input or first chunk and return a list of encodings,
+        the unicode test can be skipped if it has already been done"""
     # alternatives: https://github.com/scrapy/w3lib/blob/master/w3lib/encoding.py
     # unicode-test
-    if isutf8(bytesobject):
+    if test_utf8 and isutf8(bytesobject):
         return ['utf-8']
     guesses = []
     # additional module
@@ -125,7 +126,7 @@ def detect_encoding(bytesobject):
     # return alternatives
     if len(detection_results) > 0:
         guesses.extend([r.encoding for r in detection_results])
-    # it cannot be utf-8 (tested above)
+    # it cannot be utf-8 (tested above or by the caller)
     return [g for g in guesses if g not in UNICODE_ALIASES]
 
 
@@ -147,8 +148,13 @@ def decode_file(filecontent):
     htmltext = None
     # GZip and Brotli test
     filecontent = handle_compressed_file(filecontent)
-    # encoding
-    for guessed_encoding in detect_encoding(filecontent):
+    # most common case: decode UTF-8 directly instead of testing it first
+    try:
+        return filecontent.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    # encoding, UTF-8 has already been ruled out
+    for guessed_encoding in detect_encoding(filecontent, test_utf8=False):
         try:
             htmltext = filecontent.decode(guessed_encoding)
         except (LookupError, UnicodeDecodeError): # VISCII: lookup